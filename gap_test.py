@@ -23,7 +23,7 @@ import sqlite3
 import time
 import queue
 
-import gmpy2
+import numpy as np
 
 import gap_utils
 import gap_utils_primes
@@ -61,7 +61,7 @@ def get_arg_parser():
 
     parser.add_argument(
         '-t', '--threads', type=int, default=1,
-        help="Number of threads to use for searching (default: %(default)s)")
+        help="Number of threads to use for searching, 0 for one per CPU (default: %(default)s)")
 
     parser.add_argument(
         '--taskset', action='store_true',
@@ -93,7 +93,7 @@ def process_line(
         early_stop_flag, work_q, results_q, prob_side_threshold, sides_tested,
         prob_prime, prob_prime_after_sieve, record_gaps, side_skip_enabled,
         thread_i, SL, K, P, D, megagap,
-        primes, remainder):
+        primes, remainder, use_pfgw):
     def cleanup(*_):
         work_q.close()
         work_q.join_thread()
@@ -131,7 +131,9 @@ def process_line(
         assert mi == m_test
 
         # Used for openPFGW
-        str_n = "{}*{}#/{}+".format(m, P, D)
+        str_K = "{}#/{}".format(P, D)
+        str_n = "{}*{}+".format(m, str_K)
+        center = m * K
 
         t0 = time.time()
 
@@ -143,7 +145,8 @@ def process_line(
         # prev_p > 0 means we loaded a partial result
         if prev_p <= 0:
             p_tests, prev_p = gap_utils_primes.determine_prev_prime(
-                    m, str_n, K, unknowns[0], SL, primes, remainder)
+                    m, str_n, str_K, center, unknowns[0], SL,
+                    primes, remainder, use_pfgw)
 
         test_next = True
         new_prob_record = 0
@@ -193,7 +196,9 @@ def process_line(
 
         n_tests, next_p = 0, 0
         if test_next:
-            n_tests, next_p = gap_utils_primes.determine_next_prime(m, str_n, K, unknowns[1], SL)
+            n_tests, next_p = gap_utils_primes.determine_next_prime(
+                    m, str_n, str_K, center, unknowns[1], SL,
+                    primes, remainder, use_pfgw)
 
         test_time = time.time() - t0
 
@@ -216,8 +221,14 @@ def run_in_parallel(
 ):
     # XXX: Cleanup after gmpy2.prev_prime.
     # Remainders of (p#/d) mod prime
-    primes = tuple([p for p in range(3, 80000+1) if gmpy2.is_prime(p)])
-    remainder = tuple([K % prime for prime in primes])
+    primes = tuple(gap_utils_primes.sieve_primes(80000)[1:])
+    remainder = tuple([int(K % prime) for prime in primes])
+    if gap_utils_primes.has_numba:
+        primes = np.array(primes, dtype=np.int64)
+        remainder = np.array(remainder, dtype=np.int64)
+
+    use_pfgw = gap_utils_primes.should_use_pfgw(K, data.last_m)
+    print("Using {} for PRP tests".format("OpenPFGW" if use_pfgw else "gmpy2"))
 
     # Based on args
     prob_threshold, m_probs = gap_test_stats.determine_test_threshold(args, data)
@@ -232,6 +243,8 @@ def run_in_parallel(
         return
 
     # Worker setup
+    if args.threads == 0:
+        args.threads = min(64, os.cpu_count() or 1)
     assert args.threads in range(1, 65), args.threads
 
     early_stop_flag = multiprocessing.Event()
@@ -271,7 +284,7 @@ def run_in_parallel(
                 *one_sided_args,
                 i, args.sieve_length, K, args.p, args.d,
                 args.megagap,
-                primes, remainder
+                primes, remainder, use_pfgw
             )
         )
         process.start()
@@ -356,12 +369,16 @@ def run_in_parallel(
             gap_test_stats.process_result(conn, args, record_gaps, m_probs, data, sc, result)
         except KeyboardInterrupt:
             print("Received second Ctrl+C | Terminating now")
+            conn.commit()
             for i, p in enumerate(processes):
                 if p.is_alive():
                     print("\tTerminating thread", i)
                     p.terminate()
             exit(1)
 
+    # Commit any results from the last batch
+    conn.commit()
+
     print("Joining work_q (should be instant)")
     work_q.join()
     work_q.close()
@@ -418,7 +435,7 @@ def prime_gap_test(args):
             args.unknown_filename, "unknowns", "txt")
     if os.path.exists(folder_unk):
         args.unknown_filename = folder_unk
-    unknown_file = open(args.unknown_filename, "rb")
+    unknown_file = gap_utils.open_unknown_file(args.unknown_filename)
 
     count_m = misc_utils.count_num_m(M, M_inc, D)
 
@@ -433,8 +450,7 @@ def prime_gap_test(args):
 
     # used in next_prime
     assert P <= 80000
-    # Very slow but works.
-    P_primes = [p for p in range(2, P+1) if gmpy2.is_prime(p)]
+    P_primes = gap_utils_primes.sieve_primes(P)
 
     # ----- Allocate memory for a handful of utility functions.
 
@@ -448,7 +464,11 @@ def prime_gap_test(args):
     sc = gap_test_stats.StatCounters(time.time(), time.time())
     data = gap_test_stats.GapData()
 
-    valid_mi = [mi for mi in range(M_inc) if math.gcd(M + mi, D) == 1]
+    # Sieve out m that share a factor with D
+    is_coprime = np.ones(M_inc, dtype=bool)
+    for p in set(misc_utils.factor_simple(D)):
+        is_coprime[-M % p::p] = False
+    valid_mi = np.flatnonzero(is_coprime).tolist()
     data.first_m = M + valid_mi[0]
     data.last_m = M + valid_mi[-1]
     data.valid_mi = valid_mi
@@ -484,7 +504,7 @@ def prime_gap_test(args):
         data_db.valid_mi = valid_mi
 
         assert len(data_db.experimental_gap) >= len(data.experimental_gap)
-        assert misc_db.prob_gap_comb, len(misc_db.prob_gap_comb)
+        assert misc_db.prob_gap_comb.any(), len(misc_db.prob_gap_comb)
 
         del data
 
@@ -494,7 +514,7 @@ def prime_gap_test(args):
                     args, data_db, K_log, prob_prime_after_sieve)
 
         # XXX: move inside plot_stuff
-        with open(args.unknown_filename, "rb") as unknown_file_repeat:
+        with gap_utils.open_unknown_file(args.unknown_filename) as unknown_file_repeat:
             if False:
                 # First three lines is easy.
                 unk_mi_of_interest = valid_mi[:3]
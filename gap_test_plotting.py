@@ -32,7 +32,7 @@ def stats_plots(
         """There should be no trend based on m value"""
         # Have to adjust for Expected gap which has two data points for each m
         if len(y) == 2 * len(x):
-            x = [xi for xi in x for _ in ['l', 'r']]
+            x = np.repeat(x, 2)
 
         trend, _ = np.polyfit(x, y, 1)
         if trend > 2e-3:
@@ -75,14 +75,15 @@ def stats_plots(
         axis.legend(loc='upper left')
 
     def plot_prob_hist(axis, label, probs, max_x, color):
-        x, w = zip(*sorted(((g, v) for g, v in probs.items() if v > 0 and g <= max_x)))
+        x = np.flatnonzero(probs[:int(max_x) + 1] > 0)
+        w = probs[x]
         n, _, _ = axis.hist(x, weights=w, bins=100, density=True,
                             label='Theoretical P(gap)', color=color, alpha=0.4)
         print(f"|P({label})| = {len(x)}, Sum(P({label})) = {sum(w):.1f}")
         return n
 
     def prob_histogram_all(axis, probs, experimental, label, c1='blueviolet', c2='peru'):
-        max_x = 0.95 * max(probs.keys())
+        max_x = 0.95 * (len(probs) - 1)
 
         if experimental:
             # If this is P(combined gap) and used --one-side-skipped
@@ -261,27 +262,28 @@ def stats_plots(
             axis.set_xlabel(" # of m's tested")
             axis.set_ylabel(f'Sum(P(gap {label})')
 
+            # numpy arrays instead of lists of tuples, can be millions of m
+            p_gap_merit_ord = np.asarray(prob_data, dtype=np.float64)
+            p_gap_merit_sorted = np.sort(p_gap_merit_ord)[::-1]
+
             # This assumes that experimental_gap is indexed the same as prob_data
             # This is not true unless --prp-top-percent is 100
             if len(prob_data) == len(data.experimental_gap):
-                zipped = list(zip(prob_data, data.experimental_gap))
+                gap_real_ord = np.asarray(data.experimental_gap)
             else:
                 print("Not all gaps are present (--prp-top-percent < 100) can't show 'Sum(P(...))'")
-                zipped = list(zip(prob_data, [0 for _ in range(len(prob_data))]))
-
-            p_gap_merit_sorted, _ = zip(*sorted(zipped, reverse=True))
-            p_gap_merit_ord, gap_real_ord = zip(*zipped)
+                gap_real_ord = np.zeros(len(prob_data), dtype=np.int32)
 
             # Experimental
             if row == 1:
-                cum_count = np.cumsum(np.array(gap_real_ord) > min_merit_gap)
+                cum_count = np.cumsum(gap_real_ord > min_merit_gap)
             else:
-                cum_count = np.cumsum(np.array([g in record_gaps for g in gap_real_ord]))
+                cum_count = np.cumsum(np.isin(gap_real_ord, list(record_gaps)))
 
-            print(f"{label:20} | sum(P) = {sum(prob_data):.4f}, "
+            print(f"{label:20} | sum(P) = {p_gap_merit_ord.sum():.4f}, "
                   f"count(experimental) = {cum_count[-1]}")
 
-            tests = list(range(1, len(p_gap_merit_ord)+1))
+            tests = np.arange(1, len(p_gap_merit_ord) + 1)
             if cum_count[-1] > 0:
                 axis.plot(tests, cum_count, label='Count ' + label)
 
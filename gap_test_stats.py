@@ -18,12 +18,12 @@ import array
 import itertools
 import math
 import time
-from collections import defaultdict
 from dataclasses import dataclass
 
-import gmpy2
+import numpy as np
 
 import gap_utils
+import gap_utils_primes
 
 
 @dataclass
@@ -56,6 +56,9 @@ class StatCounters:
     count_record = 0
     count_min_merit = 0
 
+    # results are committed in batches (see process_result)
+    last_commit_t = 0
+
 
 @dataclass
 class GapData:
@@ -78,8 +81,9 @@ class GapData:
 
 @dataclass
 class Misc:
-    prob_gap_side = defaultdict(float)
-    prob_gap_comb = defaultdict(float)
+    # Indexed by gap
+    prob_gap_side = np.zeros(0)
+    prob_gap_comb = np.zeros(0)
 
     test_unknowns = {}
 
@@ -187,11 +191,10 @@ def load_stats(conn, args):
         "SELECT gap, prob_combined, prob_low_side, prob_high_side "
         "FROM range_stats where rid = ?",
         (config_hash(args),))
-    for row in rv:
-        gap = row[0]
-        misc.prob_gap_comb[gap] += row[1]
-        misc.prob_gap_side[gap] += row[2] / 2
-        misc.prob_gap_side[gap] += row[3] / 2
+    rows = np.array(rv.fetchall(), dtype=np.float64).reshape(-1, 4)
+    gaps = rows[:, 0].astype(np.int64)
+    misc.prob_gap_comb = np.bincount(gaps, weights=rows[:, 1])
+    misc.prob_gap_side = np.bincount(gaps, weights=(rows[:, 2] + rows[:, 3]) / 2)
 
     return data, misc
 
@@ -212,7 +215,6 @@ def save(conn, p, d, m, next_p, prev_p, merit,
         WHERE p=? AND d=? AND m=?""",
         (next_p, prev_p, round(merit, 4),
          n_tests, p_tests, test_time, p, d, m))
-    conn.commit()
 
 
 def prob_prime_sieve_length(M, K, D, prob_prime, K_digits, P_primes, SL, max_prime):
@@ -224,21 +226,28 @@ def prob_prime_sieve_length(M, K, D, prob_prime, K_digits, P_primes, SL, max_pri
 
     prob_prime_after_sieve = prob_prime / unknowns_after_sieve
 
-    prob_prime_coprime_p = 1
-    for prime in P_primes:
-        prob_prime_coprime_p *= (1 - 1 / prime)
+    P_primes_np = np.array(P_primes, dtype=np.float64)
+    prob_prime_coprime_p = float(np.prod((P_primes_np - 1) / P_primes_np))
 
-    K_coprime = [math.gcd(K, i) == 1 for i in range(SL + 1)]
+    # Sieve out multiples of the primes in K (P_primes that don't divide D)
+    K_coprime = np.ones(SL + 1, dtype=bool)
+    D_primes = []
+    for prime in P_primes:
+        if D % prime:
+            K_coprime[::prime] = False
+        else:
+            D_primes.append(prime)
 
     # See "Optimizing Choice Of D" in THEORY.md for why this is required
     count_coprime_p = 0
     m_tests = [M + i for i in range(100) if math.gcd(M + i, D) == 1][:6]
     for m in m_tests:
         N_mod_D = m * K % D
-        for i in range(1, SL + 1):
-            if K_coprime[i] and math.gcd(N_mod_D + i, D) == 1:
-                # assert gmpy2.gcd(N, K*D) == 1,
-                count_coprime_p += 1
+        # Also remove i where gcd(N + i, D) > 1
+        coprime = K_coprime.copy()
+        for prime in D_primes:
+            coprime[-N_mod_D % prime::prime] = False
+        count_coprime_p += int(coprime[1:].sum())
 
     count_coprime_p //= len(m_tests)
 
@@ -263,13 +272,22 @@ def prob_prime_sieve_length(M, K, D, prob_prime, K_digits, P_primes, SL, max_pri
 
 def calculate_expected_gaps(
         SL, min_merit_gap, prob_nth, prob_longer, log_n, unknowns, data):
+    # prob_nth and prob_longer stop once negligible, past that use the closed form
+    prob_prime = prob_nth[0]
+
+    def nth(k):
+        return prob_nth[k] if k < len(prob_nth) else prob_prime * (1 - prob_prime) ** k
+
+    def longer(k):
+        return prob_longer[k] if k < len(prob_longer) else (1 - prob_prime) ** k
+
     for i, side in enumerate(unknowns):
         expected_length = 0
         for v, prob in zip(side, prob_nth):
             expected_length += abs(v) * prob
 
         # expected to encounter a prime at distance ~= ln(n)
-        prob_gap_longer = prob_nth[len(side)]
+        prob_gap_longer = nth(len(side))
         assert prob_gap_longer < 0.01, (prob_gap_longer, len(side))
         expected_length += (SL + log_n) * prob_gap_longer
 
@@ -280,30 +298,30 @@ def calculate_expected_gaps(
 
     data.expected_gap.append(data.expected_prev[-1] + data.expected_next[-1])
 
-    p_merit = 0
-    for prob_i, lower in zip(prob_nth, unknowns[0]):
-        for prob_j, upper in zip(prob_nth, unknowns[1]):
-            prob_joint = prob_i * prob_j
-            gap = -lower + upper
-            if gap >= min_merit_gap:
-                p_merit += prob_joint
+    prob_nth = np.asarray(prob_nth)
+    lower = np.array(unknowns[0][:len(prob_nth)])
+    upper = np.array(unknowns[1][:len(prob_nth)])
+    prob_l = prob_nth[:len(lower)]
+    prob_u = prob_nth[:len(upper)]
 
-            if prob_joint < 1e-9:
-                break
-        else:
-            # gap = (K + SL+1) - (K - lower) = SL+1 - lower
-            if -lower + SL + 1 > min_merit_gap:
-                p_merit += prob_i * prob_longer[len(unknowns[1])]
+    # prob_joint[i, j] = P(lower[i] is prev prime and upper[j] is next prime)
+    prob_joint = np.outer(prob_l, prob_u)
+    gaps = upper[np.newaxis, :] - lower[:, np.newaxis]
+    p_merit = float(prob_joint[gaps >= min_merit_gap].sum())
+
+    # prob no prime in unknowns[0] / unknowns[1]
+    longer_l = longer(len(unknowns[0]))
+    longer_u = longer(len(unknowns[1]))
 
-    for prob_j, upper in zip(prob_nth, unknowns[1]):
-        if SL + 1 + upper > min_merit_gap:
-            p_merit += prob_j * prob_longer[len(unknowns[0])]
+    # gap = (K + SL+1) - (K - lower) = SL+1 - lower
+    p_merit += prob_l[SL + 1 - lower > min_merit_gap].sum() * longer_u
+    p_merit += prob_u[SL + 1 + upper > min_merit_gap].sum() * longer_l
 
     if 2 * SL + 1 > min_merit_gap:
-        p_merit += prob_longer[len(unknowns[0])] * prob_longer[len(unknowns[1])]
+        p_merit += longer_l * longer_u
 
     assert 0 <= p_merit <= 1.00, (p_merit, unknowns)
-    data.prob_merit_gap.append(p_merit)
+    data.prob_merit_gap.append(float(p_merit))
 
 
 def validate_prob_record_merit(
@@ -317,7 +335,8 @@ def validate_prob_record_merit(
     prob_nth = []
     prob_longer = []
     prob_gap_longer = 1
-    while prob_gap_longer > 1e-13:
+    # Longer is negligible, also keeps the prob_joint matrix small.
+    while prob_gap_longer > 1e-12:
         prob_nth.append(prob_gap_longer * prob_prime_after_sieve)
         prob_longer.append(prob_gap_longer)
         prob_gap_longer *= (1 - prob_prime_after_sieve)
@@ -357,11 +376,10 @@ def setup_extended_gap(SL, P, D, prob_prime):
 
     Used in prob_record_one_sided
     """
-    K_primes = [p for p in range(2, P + 1) if gmpy2.is_prime(p)]
-    prob_prime_coprime = prob_prime
-    for p in K_primes:
-        # multiples of d are handled in prob_record_one_side
-        prob_prime_coprime /= (1 - 1 / p)
+    K_primes = gap_utils_primes.sieve_primes(P)
+    # multiples of d are handled in prob_record_one_side
+    K_primes_np = np.array(K_primes, dtype=np.float64)
+    prob_prime_coprime = prob_prime / float(np.prod((K_primes_np - 1) / K_primes_np))
 
     is_coprime = [True for _ in range(2 * SL)]
     for p in K_primes:
@@ -513,6 +531,11 @@ def process_result(conn, args, record_gaps, m_probs, data, sc, result):
 
     save(conn, args.p, args.d, m, next_p, prev_p, merit, n_tests, p_tests, test_time)
 
+    # Partial results are committed right away, others at most every 10 seconds
+    if next_p < 0 or prev_p < 0 or time.time() - sc.last_commit_t > 10:
+        conn.commit()
+        sc.last_commit_t = time.time()
+
     if next_p < 0 or prev_p < 0:
         # partial result don't print anything
         return
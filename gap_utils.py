@@ -15,17 +15,22 @@
 # limitations under the License.
 
 import contextlib
+import io
 import logging
+import mmap
 import os
 import re
 import sys
 
 import gmpy2
+import numpy as np
 
 
 UNKNOWN_FILENAME_RE = re.compile(
     r"^(\d+)_(\d+)_(\d+)_(\d+)_s(\d+)_l(\d+)M(.m1)?(?:.missing)?.txt")
 
+UNKNOWN_LINE_START_RE = re.compile(rb"^([0-9]+) : -([0-9]+) \+([0-9]+)")
+
 
 class TeeLogger:
     def __init__(self, fn, out):
@@ -147,12 +152,21 @@ def K_and_stats(args):
     return K, K_digits, K_bits, K_log
 
 
+def open_unknown_file(fn):
+    """Read-only mmap of fn, readline() returns bytes without a file buffer copy"""
+    with open(fn, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap can't map an empty file
+            return io.BytesIO()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
 def parse_unknown_line(line):
     unknowns = [[], []]
 
     start, c_l, c_h = line.split(b" | ")
 
-    match = re.match(rb"^([0-9]+) : -([0-9]+) \+([0-9]+)", start)
+    match = UNKNOWN_LINE_START_RE.match(start)
     assert match, start
     m_test, unknown_l, unknown_u = map(int, match.groups())
 
@@ -172,9 +186,9 @@ def parse_unknown_line(line):
         unknowns[0] = accum_rle(-1, c_l)
         unknowns[1] = accum_rle(+1, c_h[:-1])
     else:
-        # TODO investigate using array.array
-        unknowns[0] = list(map(int, c_l.split(b" ")))
-        unknowns[1] = list(map(int, c_h.split(b" ")))
+        # numpy parses in C, tolist so gmpy2 gets python ints
+        unknowns[0] = np.fromstring(c_l, dtype=np.int32, sep=" ").tolist()
+        unknowns[1] = np.fromstring(c_h, dtype=np.int32, sep=" ").tolist()
 
     unknown_l_test = len(unknowns[0])
     unknown_u_test = len(unknowns[1])
@@ -14,12 +14,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import math
 import re
 import subprocess
 import time
 import tempfile
 
 import gmpy2
+import numpy as np
 
 try:
     # primegapverify is only alpha so don't require it yet
@@ -29,28 +31,63 @@ try:
 except ModuleNotFoundError:
     has_pgv = False
 
+try:
+    # numba is optional, only speeds up the slow prev_prime fallback
+    import numba
+
+    has_numba = True
+except ModuleNotFoundError:
+    has_numba = False
+
+
+def sieve_primes(n):
+    """List of primes <= n (Sieve of Eratosthenes)"""
+    composite = np.zeros(n + 1, dtype=bool)
+    composite[:2] = True
+    for p in range(2, math.isqrt(n) + 1):
+        if not composite[p]:
+            composite[p * p::p] = True
+    return np.flatnonzero(~composite).tolist()
+
+
+# is_prime uses OpenPFGW for numbers with more bits than this
+PFGW_MIN_BITS = 8000
+
+
+def should_use_pfgw(K, max_m):
+    """m * K is the same size (within a bit or two) for all m so only check once"""
+    return gmpy2.num_digits(K, 2) + max_m.bit_length() > PFGW_MIN_BITS
+
+
+def gmp_has_fast_next_prime():
+    """GMP >= 6.2.99 sieves in mpz_nextprime, older versions test every odd number"""
+    match = re.match(r"GMP (\d+)\.(\d+)\.(\d+)", gmpy2.mp_version())
+    return bool(match) and tuple(map(int, match.groups())) >= (6, 2, 99)
 
-def is_prime(num, str_n, dist):
-    # TODO print log of which library is being used.
-    if gmpy2.num_digits(num, 2) > 8000:
+
+def is_prime(num, str_n, dist, use_pfgw):
+    if use_pfgw:
         return openPFGW_is_prime(str_n + str(dist))
 
     return gmpy2.is_prime(num)
 
 
 def openPFGW_is_prime(str_n):
-    # XXX: getstatusoutput runs in a shell, does this double the overhead?
     # Overhead of subprocess calls seems to be ~0.03
-    s = subprocess.getstatusoutput("./pfgw64 -f0 -q" + str_n)
-    assert s[1].startswith('PFGW'), s
-    return s[0] == 0
+    # No shell and no output capture, pfgw's exit code is 0 for PRP
+    s = subprocess.run(
+        ["./pfgw64", "-f0", "-q" + str_n],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Anything else means pfgw failed, not that str_n is composite
+    assert s.returncode in (0, 1), s.returncode
+    return s.returncode == 0
 
 
-def openPFGW_ABC(m, K, offsets):
+def openPFGW_ABC(m, str_K, offsets):
     """
     See pfgw's abcfileformats.txt for details
 
-    Produces a temp file with this content
+    Produces a temp file with this content (for m = 13, str_K = "1009#/3018")
       ABC $a*1009#/3018+$b // {number_primes,$a,1}
       13 4
       13 12
@@ -64,76 +101,169 @@ def openPFGW_ABC(m, K, offsets):
     assert len(offsets) < 50000, len(offsets)
 
     with tempfile.NamedTemporaryFile(mode="w") as abc:
-        abc.write(f"ABC $a*{K}+$b // {{number_primes,$a,1}}\n")
+        abc.write(f"ABC $a*{str_K}+$b // {{number_primes,$a,1}}\n")
         for offset in offsets:
             abc.write(f"{m} {offset}\n")
         abc.flush()
 
-        s = subprocess.getstatusoutput(f"./pfgw64 -f0 {abc.name}")
-        assert s[0] in (0, 1), s
-        assert s[1].startswith('PFGW'), s
+        s = subprocess.run(
+            ["./pfgw64", "-f0", abc.name],
+            capture_output=True, text=True)
+        assert s.returncode in (0, 1), s
+        assert s.stdout.startswith('PFGW'), s
 
         # TODO how to validate doesn't skip because previous processed?
-        # if "failed" in s[1] or "previous" in s[1]:
-        #    print(s[1])
+        # if "failed" in s.stdout or "previous" in s.stdout:
+        #    print(s.stdout)
         #    assert False
 
         # Look for "1*1009#/3018+512 is 3-PRP! (0.0021s+0.0000s)"
-        if 'is 3-PRP' in s[1]:
-            offset = int(re.search(r'\+(-?[0-9]+) is 3-PRP', s[1]).group(1))
+        if 'is 3-PRP' in s.stdout:
+            offset = int(re.search(r'\+(-?[0-9]+) is 3-PRP', s.stdout).group(1))
             index = offsets.index(offset)
             return offset, index + 1
 
     return None, len(offsets)
 
 
-def determine_next_prime(m, str_n, K, unknowns, SL):
-    center = m * K
+def openPFGW_first_prime(m, str_K, offsets):
+    """(tests, offset) of the first PRP in offsets, offset is None if all are composite
+
+    One pfgw call per batch of offsets instead of one per offset.
+    """
     tests = 0
+    for b in range(0, len(offsets), 64):
+        offset, batch_tests = openPFGW_ABC(m, str_K, offsets[b:b + 64])
+        tests += batch_tests
+        if offset is not None:
+            return tests, offset
+    return tests, None
 
-    for i in unknowns:
-        assert i > 0
-        tests += 1
-        if is_prime(center + i, str_n, i):
-            return tests, i
+
+# 2 * 3 * 5 * 7
+WHEEL_SIZE = 210
+
+
+def _wheel(center):
+    """Residues r (mod WHEEL_SIZE) where center - r is coprime to 2, 3, 5, and 7"""
+    c = int(center % WHEEL_SIZE)
+    return [r for r in range(WHEEL_SIZE) if math.gcd(c - r, WHEEL_SIZE) == 1]
+
+
+def _next_candidate(start, stop, wheel, primes, modulos):
+    """Smallest i in [start, stop] with i % primes[j] != modulos[j] for all j, -1 if none
+
+    Only i with i % WHEEL_SIZE in wheel are tried (48 of every 210)
+    For m * K - i use modulos[j] = (m * K) % primes[j]
+    For m * K + i use modulos[j] = -(m * K) % primes[j]
+    """
+    base = start - start % WHEEL_SIZE
+    while base <= stop:
+        for r in wheel:
+            i = base + r
+            if i < start or i > stop:
+                continue
+
+            composite = False
+            for j in range(len(primes)):
+                if i % primes[j] == modulos[j]:
+                    composite = True
+                    break
+            if not composite:
+                return i
+        base += WHEEL_SIZE
+    return -1
+
+
+if has_numba:
+    # wheel, primes, and modulos need to be int64 numpy arrays
+    _next_candidate = numba.njit(cache=True)(_next_candidate)
+
+
+def determine_next_prime(
+        m, str_n, str_K, center, unknowns, SL, primes, remainder, use_pfgw):
+    tests = 0
+
+    # unknowns have no factor <= max_prime (>= 1M) so there's nothing for
+    # trial division to find before is_prime; the same holds for prev_prime.
+    if use_pfgw:
+        tests, next_p = openPFGW_first_prime(m, str_K, unknowns)
+        if next_p is not None:
+            return tests, next_p
+    else:
+        for i in unknowns:
+            assert i > 0
+            tests += 1
+            if is_prime(center + i, str_n, i, use_pfgw):
+                return tests, i
 
     # next_prime(...) outside of SL
-    tests1, next_p = determine_next_prime_large(m, K, SL)
+    tests1, next_p = determine_next_prime_large(
+        m, str_n, center, SL, primes, remainder, use_pfgw)
     return tests + tests1, next_p
 
 
-def determine_prev_prime(m, str_n, K, unknowns, SL, primes, remainder):
-    center = m * K
+def determine_prev_prime(
+        m, str_n, str_K, center, unknowns, SL, primes, remainder, use_pfgw):
     tests = 0
 
-    for i in unknowns:
-        assert i < 0
-        tests += 1
-        if is_prime(center + i, str_n, i):
-            return tests, -i
+    if use_pfgw:
+        tests, prev_p = openPFGW_first_prime(m, str_K, unknowns)
+        if prev_p is not None:
+            return tests, -prev_p
+    else:
+        for i in unknowns:
+            assert i < 0
+            tests += 1
+            if is_prime(center + i, str_n, i, use_pfgw):
+                return tests, -i
 
     # prev_prime(...) outside of SL need more code.
-    tests1, prev_p = determine_prev_prime_large(m, str_n, K, SL, primes, remainder)
+    tests1, prev_p = determine_prev_prime_large(
+        m, str_n, center, SL, primes, remainder, use_pfgw)
     return tests + tests1, prev_p
 
 
-def determine_next_prime_large(m, K, SL):
-    # XXX: PFGW fallback
+def determine_next_prime_large(m, str_n, center, SL, primes, remainder, use_pfgw):
+    if not use_pfgw and gmp_has_fast_next_prime():
+        # Double checks center + SL.
+        next_p = int(gmpy2.next_prime(center + SL) - center)
+        return 0, next_p
 
-    # XXX: parse to version and verify > 6.2.99
-    assert gmpy2.mp_version() == 'GMP 6.2.99', gmpy2.mp_version()
+    # OpenPFGW or old GMP, sieve candidates with the wheel and test survivors
+    t0 = time.time()
+    tests = 0
+    # -(m * K) % prime is fixed for all i
+    # Computed with python ints, remain * m overflows int64 for large m
+    wheel = _wheel(-center)
+    modulos = tuple(-int(remain) * m % int(prime) for prime, remain in zip(primes, remainder))
+    if has_numba:
+        wheel = np.array(wheel, dtype=np.int64)
+        modulos = np.array(modulos, dtype=np.int64)
+
+    # Search [SL + 1, stop], extending stop until a prime is found.
+    start, stop = SL + 1, 5 * SL
+    while True:
+        i = _next_candidate(start, stop, wheel, primes, modulos)
+        if i < 0:
+            start, stop = stop + 1, 2 * stop
+            continue
 
-    center = m * K
-    # Double checks center + SL.
-    next_p = int(gmpy2.next_prime(center + SL) - center)
-    return 0, next_p
+        tests += 1
+        if is_prime(center + i, str_n, i, use_pfgw):
+            t1 = time.time()
+            t = t1 - t0
+            if t > 60:
+                print("\tnext_prime({}{}) took {:.2f} second ({} tests, {:.3f}s/test"
+                      .format(str_n, SL, t, tests, t / tests))
+            return tests, i
+        start = i + 1
 
 
-def determine_prev_prime_large(m, str_n, K, SL, primes, remainder):
+def determine_prev_prime_large(m, str_n, center, SL, primes, remainder, use_pfgw):
     global has_pgv
 
     tests = 0
-    center = m * K
     if has_pgv:
         t0 = time.time()
         # primegapverify sieve a big interval below
@@ -150,7 +280,7 @@ def determine_prev_prime_large(m, str_n, K, SL, primes, remainder):
         for i, composite in enumerate(reversed(composites)):
             if not composite:
                 tests += 1
-                if is_prime(center - (SL + i), str_n, -(SL + i)):
+                if is_prime(center - (SL + i), str_n, -(SL + i), use_pfgw):
                     t1 = time.time()
                     if (t1 - t0) > 60:
                         print("\tprimegapverify prev_prime({}{}) took {:.2f} second "
@@ -165,22 +295,25 @@ def determine_prev_prime_large(m, str_n, K, SL, primes, remainder):
     print("Falling back to slow prev_prime({}{})".format(str_n, -SL))
     t0 = time.time()
     tests0 = tests
-    for i in range(SL, 5 * SL + 1):
-        composite = False
-        for prime, remain in zip(primes, remainder):
-            modulo = (remain * m) % prime
-            if i % prime == modulo:
-                composite = True
-                break
-        if not composite:
-            tests += 1
-            if is_prime(center - i, str_n, -i):
-                t1 = time.time()
-                t = t1 - t0
-                if t > 60:
-                    num_tests = tests - tests0
-                    print("\tfallback prev_prime({}{}) took {:.2f} second ({} tests, {:.3f}s/test"
-                          .format(str_n, -SL, t, num_tests, t / num_tests))
-                return tests, i
+    # (m * K) % prime is fixed for all i
+    # Computed with python ints, remain * m overflows int64 for large m
+    wheel = _wheel(center)
+    modulos = tuple(int(remain) * m % int(prime) for prime, remain in zip(primes, remainder))
+    if has_numba:
+        wheel = np.array(wheel, dtype=np.int64)
+        modulos = np.array(modulos, dtype=np.int64)
+
+    i = _next_candidate(SL, 5 * SL, wheel, primes, modulos)
+    while i >= 0:
+        tests += 1
+        if is_prime(center - i, str_n, -i, use_pfgw):
+            t1 = time.time()
+            t = t1 - t0
+            if t > 60:
+                num_tests = tests - tests0
+                print("\tfallback prev_prime({}{}) took {:.2f} second ({} tests, {:.3f}s/test"
+                      .format(str_n, -SL, t, num_tests, t / num_tests))
+            return tests, i
+        i = _next_candidate(i + 1, 5 * SL, wheel, primes, modulos)
 
     assert False
@@ -17,7 +17,6 @@
 import argparse
 import math
 import random
-import re
 import subprocess
 
 import gmpy2
@@ -84,7 +83,7 @@ def double_check(args):
     # ----- Open Output file
     print("\tLoading unknowns from '{}'".format(args.unknown_filename))
     print()
-    unknown_file = open(args.unknown_filename, "r")
+    unknown_file = open(args.unknown_filename, "rb")
 
     # share a factor with K
     boring_composites = {i for i in range(0, SL) if gmpy2.gcd(K, i) > 1}
@@ -99,16 +98,9 @@ def double_check(args):
 
         # Read a line from the file
         line = unknown_file.readline()
-        start, u_l, u_h = line.split("|")
-
-        match = re.match(r"^([0-9]+) : -([0-9]+) \+([0-9]+)", start)
-        assert match, (len(start), len(u_l), len(u_h))
-        m_test, unknown_l, unknown_u = map(int, match.groups())
+        m_test, _, _, (low, high) = gap_utils.parse_unknown_line(line)
         assert m_test == mi
 
-        low = list(map(int, u_l.strip().split(" ")))
-        high = list(map(int, u_h.strip().split(" ")))
-
         unknowns = {i for i in low + high}
 
         # Check trivial composites not included
@@ -118,6 +110,9 @@ def double_check(args):
         str_start = f"{m} * {P}# / {D}"
         print(str_start, "\tunknowns {} + {} = {}".format(len(low), len(high), len(unknowns)))
 
+        # m * K is the same for every t
+        center = m * K
+
         # Choose some random numbers
         count = args.count
         while count > 0:
@@ -129,7 +124,7 @@ def double_check(args):
             # If sieve found a small factor
             sieve_had_factor = t not in unknowns
 
-            N = (m * K + t)
+            N = center + t
             found = False
             for p in small_primes:
                 if N % p == 0:
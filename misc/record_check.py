@@ -20,14 +20,15 @@ Replaces some awk hackery.
 """
 
 import argparse
+import array
 import glob
 import os.path
 import re
 import sqlite3
 import sys
-from collections import defaultdict
 
 import gmpy2
+import numpy as np
 import primegapverify
 
 
@@ -62,124 +63,149 @@ def get_arg_parser():
     return parser
 
 
-def describe_found_gaps(gaps):
-    gaps_by_size = sorted(g[0] for g in gaps)
-    gaps_by_merit = defaultdict(list)
-    for gap in gaps:
-        gaps_by_merit[int(gap[1])].append(gap)
+def open_prime_gaps_db(fn):
+    """Read-only connection to the records database shared by all searches"""
+    conn = sqlite3.connect(fn)
+    conn.execute("PRAGMA query_only = 1")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+    return conn
+
+
+def describe_found_gaps(sizes, merits):
+    # Views of array('q') and array('d'), no copy
+    sizes = np.asarray(sizes, dtype=np.int64)
+    merits = np.asarray(merits, dtype=np.float64)
+    int_merits = merits.astype(np.int64)
 
     print("Found {} gaps  ({:<6} to {:>6})".format(
-        len(gaps_by_size), gaps_by_size[0], gaps_by_size[-1]))
+        len(sizes), sizes.min(), sizes.max()))
     print("      {} merit ({:.3f} to {:.3f})".format(
-        " " * len(str(len(gaps_by_size))),
-        min(g[1] for g in gaps), max(g[1] for g in gaps)))
-    for int_merit, items in sorted(gaps_by_merit.items()):
+        " " * len(str(len(sizes))),
+        merits.min(), merits.max()))
+
+    # Group by int(merit), smallest gaps first within each group
+    order = np.lexsort((sizes, int_merits))
+    buckets, starts, counts = np.unique(
+        int_merits[order], return_index=True, return_counts=True)
+    for int_merit, start, count in zip(buckets.tolist(), starts.tolist(), counts.tolist()):
+        smallest = sizes[order[start:start + min(count, 2)]].tolist()
         print("    Merit {:<2} x{:<4} | {}".format(
             int_merit,
-            len(items),
-            ", ".join([str(rec[0]) for rec in sorted(items)[:2]] +
-                      ["..."] * (len(items) > 2))
+            count,
+            ", ".join([str(size) for size in smallest] + ["..."] * (count > 2))
         ))
     print()
 
 
-def print_record_gaps(args, gaps):
-    with sqlite3.connect(args.prime_gaps_db) as conn:
-        num_gaps = conn.execute('SELECT COUNT(*) FROM gaps').fetchone()[0]
-        assert num_gaps > 50000, num_gaps
-        min_merit, max_merit = conn.execute(
-            'SELECT min(merit), max(merit) FROM gaps').fetchone()
-        print("Records, {} gaps merit {:.2f} to {:.2f}".format(
-            num_gaps, min_merit, max_merit))
-
-        print("Checking", len(gaps), "gaps against records")
-        small_merit = 0
-        own_records = []
-        record_lines = []
-        for gap in gaps:
-            # gapsize, merit, raw_data, startprime, "line"
-            size = gap[0]
-            new_merit = gap[1]
-            raw_data = gap[2]
-            startprime = gap[3]
-            # These filters generated with
-            # sqlite3 gaps.db  "select min(merit) from gaps where gapsize BETWEEN 1500 AND 50000;"
-            if size <= 30000 and new_merit < 21.9:
-                continue
-            if size <= 50000 and new_merit < 18:
-                continue
-            if size <= 100000 and new_merit < 10.4:
+def could_be_record(size, merit):
+    # These filters generated with
+    # sqlite3 gaps.db  "select min(merit) from gaps where gapsize BETWEEN 1500 AND 50000;"
+    if size <= 30000 and merit < 21.9:
+        return False
+    if size <= 50000 and merit < 18:
+        return False
+    if size <= 100000 and merit < 10.4:
+        return False
+    return True
+
+
+def print_record_gaps(args, conn, sizes, merits, meta):
+    num_gaps = conn.execute('SELECT COUNT(*) FROM gaps').fetchone()[0]
+    assert num_gaps > 50000, num_gaps
+    min_merit, max_merit = conn.execute(
+        'SELECT min(merit), max(merit) FROM gaps').fetchone()
+    print("Records, {} gaps merit {:.2f} to {:.2f}".format(
+        num_gaps, min_merit, max_merit))
+
+    print("Checking", len(sizes), "gaps against records")
+
+    # Lookup records for gaps passing the filters in a few queries, not one per gap
+    records = {}
+    unique_sizes = sorted(set(
+        size for size, merit in zip(sizes, merits) if could_be_record(size, merit)))
+    for i in range(0, len(unique_sizes), 500):
+        batch = unique_sizes[i:i+500]
+        for row in conn.execute(
+                'SELECT gapsize,merit,primedigits,startprime,discoverer FROM gaps WHERE'
+                ' gapsize IN ({})'.format(",".join("?" * len(batch))), batch):
+            records.setdefault(row[0], row[1:])
+
+    small_merit = 0
+    own_records = []
+    record_lines = []
+    # meta is (raw_data, startprime, "line") for each gap
+    for size, new_merit, (raw_data, startprime, line) in zip(sizes, merits, meta):
+        if not could_be_record(size, new_merit):
+            continue
+
+        existing = records.get(size)
+
+        if not existing:
+            if new_merit < args.ignore_small and size < 1000000:
+                small_merit += 1
                 continue
 
-            existing = conn.execute(
-                'SELECT merit,primedigits,startprime,discoverer FROM gaps WHERE'
-                ' gapsize=?', (size,)).fetchone()
+            record_lines.append(raw_data)
+            print("\tRecord {:5} | {:70s} | Gap={:<6} (New!)".format(
+                len(record_lines), raw_data, size))
+            continue
+
+        # Works most of the time, could have false positives
+        is_same = existing[2].replace(" ", "") in startprime.replace(" ", "")
+        is_own_record = existing[3] == args.whoami
+
+        if is_same and not is_own_record:
+            print("\tREDISCOVERED | {:70s} (old: {})".format(raw_data, existing))
+            continue
+
+        # If obvious not an improvement don't call parse(...)
+        if existing[0] > new_merit + 0.04:
+            improvement = new_merit - existing[0] + 6e-3
+        else:
+            old_n = primegapverify.parse(existing[2])
+            if old_n:
+                # Strip to just the number section
+                new_n = primegapverify.parse(startprime)
+                assert new_n, new_n
+                improvement = float(size / gmpy2.log(new_n) - size / gmpy2.log(old_n))
+            else:
+                improvement = new_merit - existing[0] + 6e-3
 
-            if not existing:
-                if new_merit < args.ignore_small and size < 1000000:
-                    small_merit += 1
-                    continue
+        if improvement >= 0:
+            # if not is_same and improvement < 6e-3:
+            #    print("Close:", existing[2], "vs newer", startprime)
 
+            if is_same and is_own_record:
+                own_records.append(raw_data)
+                ith = len(own_records)
+                special = ith in (1, 2, 5, 10, 20, 50) or ith % 100 == 0
+                if not special:
+                    continue
+            else:
                 record_lines.append(raw_data)
-                print("\tRecord {:5} | {:70s} | Gap={:<6} (New!)".format(
-                    len(record_lines), raw_data, size))
-                continue
-
-            # Works most of the time, could have false positives
-            is_same = existing[2].replace(" ", "") in startprime.replace(" ", "")
-            is_own_record = existing[3] == args.whoami
-
-            if is_same and not is_own_record:
-                print("\tREDISCOVERED | {:70s} (old: {})".format(raw_data, existing))
-                continue
 
-            # If obvious not an improvement don't call parse(...)
-            if existing[0] > new_merit + 0.04:
-                improvement = new_merit - existing[0] + 6e-3
-            else:
-                old_n = primegapverify.parse(existing[2])
-                if old_n:
-                    # Strip to just the number section
-                    new_n = primegapverify.parse(startprime)
-                    assert new_n, new_n
-                    improvement = float(size / gmpy2.log(new_n) - size / gmpy2.log(old_n))
-                else:
-                    improvement = new_merit - existing[0] + 6e-3
-
-            if improvement >= 0:
-                # if not is_same and improvement < 6e-3:
-                #    print("Close:", existing[2], "vs newer", startprime)
-
-                if is_same and is_own_record:
-                    own_records.append(raw_data)
-                    ith = len(own_records)
-                    special = ith in (1, 2, 5, 10, 20, 50) or ith % 100 == 0
-                    if not special:
-                        continue
-                else:
-                    record_lines.append(raw_data)
-
-                print("\tRecord {:5} | {:70s} | Gap={:<6} (old: {:.2f}{} +{:.2f})".format(
-                    str(len(own_records)) + "*" if is_same else len(record_lines), gap[4], size,
-                    existing[0], " by you" * is_own_record, new_merit - existing[0]))
-
-        if record_lines:
-            print()
-            for line in record_lines:
-                print(line)
-            print()
-            print("Records {} unique {} {}".format(
-                len(record_lines),
-                len(set(line.split()[0] for line in record_lines)),
-                f"({len(own_records)} already submitted)" if own_records else ""))
-            print("Smallst:", min(record_lines))
-            print("Largest:", max(record_lines))
-            if small_merit:
-                print(f'\tHid {small_merit} new "records" with merit < {args.ignore_small}')
-            print()
-
-
-def search_logs(args):
+            print("\tRecord {:5} | {:70s} | Gap={:<6} (old: {:.2f}{} +{:.2f})".format(
+                str(len(own_records)) + "*" if is_same else len(record_lines), line, size,
+                existing[0], " by you" * is_own_record, new_merit - existing[0]))
+
+    if record_lines:
+        print()
+        for line in record_lines:
+            print(line)
+        print()
+        print("Records {} unique {} {}".format(
+            len(record_lines),
+            len(set(line.split()[0] for line in record_lines)),
+            f"({len(own_records)} already submitted)" if own_records else ""))
+        print("Smallst:", min(record_lines))
+        print("Largest:", max(record_lines))
+        if small_merit:
+            print(f'\tHid {small_merit} new "records" with merit < {args.ignore_small}')
+        print()
+
+
+def search_logs(args, gaps_conn):
     # 32280  10.9749  5641 * 3001#/2310 -18514 to +13766
     record_format = re.compile(
         r"(\d+)\s+(\d+\.\d+)\s+"
@@ -189,7 +215,10 @@ def search_logs(args):
     assert os.path.exists(args.logs_directory), (
         "Logs directory ({}) doesn't exist".format(args.logs_directory))
 
-    gaps = []
+    # Columns of gapsize, merit, (submit format, number, line)
+    sizes = array.array('q')
+    merits = array.array('d')
+    meta = []
     for log_fn in glob.glob(args.logs_directory + "/*.log"):
         with open(log_fn, "r") as f:
             lines = f.readlines()
@@ -199,7 +228,8 @@ def search_logs(args):
 
         file_match = 0
         for li, line in enumerate(lines):
-            if ' ' not in line:
+            # Every match contains "P#/D", cheap literal check skips most lines
+            if '#/' not in line:
                 continue
             match = record_format.search(line)
             if match:
@@ -209,31 +239,31 @@ def search_logs(args):
                     print("    Match {} at line {}: {}".format(
                         file_match, li, partial_line))
 
-                gaps.append([
-                    # gap
-                    int(match.group(1)),
-                    # merit
-                    float(match.group(2)),
+                sizes.append(int(match.group(1)))
+                merits.append(float(match.group(2)))
+                meta.append((
                     # submit format
                     " ".join(match.groups()),
                     # number
                     " ".join(match.groups()[2:]),
                     # line
                     line,
-                ])
+                ))
 
-    if gaps:
-        describe_found_gaps(gaps)
-        print_record_gaps(args, gaps)
+    if sizes:
+        describe_found_gaps(sizes, merits)
+        print_record_gaps(args, gaps_conn, sizes, merits, meta)
     else:
         print("Didn't find any gaps in logs directory({})".format(
             args.logs_directory))
 
 
-def search_db(args):
+def search_db(args, gaps_conn):
     assert os.path.exists(args.search_db)
 
-    gaps = []
+    sizes = array.array('q')
+    merits = array.array('d')
+    meta = []
     with sqlite3.connect(args.search_db, timeout=10) as conn:
         conn.row_factory = sqlite3.Row
 
@@ -261,13 +291,15 @@ def search_db(args):
                 gapsize, merit,
                 number, gap["next_p"])
 
-            gaps.append((
-                gapsize, merit, submit, number,
+            sizes.append(gapsize)
+            merits.append(merit)
+            meta.append((
+                submit, number,
                 ", ".join(f"{k}={gap[k]}" for k in ('p', 'd', 'm', 'prev_p', 'next_p')),
             ))
 
-    describe_found_gaps(gaps)
-    print_record_gaps(args, gaps)
+    describe_found_gaps(sizes, merits)
+    print_record_gaps(args, gaps_conn, sizes, merits, meta)
 
 
 if __name__ == "__main__":
@@ -277,14 +309,18 @@ if __name__ == "__main__":
     assert os.path.exists(args.prime_gaps_db), (
         f"Prime gaps database ({args.prime_gaps_db!r}) doesn't exist")
 
+    gaps_conn = open_prime_gaps_db(args.prime_gaps_db)
+
     neither = True
     if os.path.exists(args.logs_directory):
         neither = False
-        search_logs(args)
+        search_logs(args, gaps_conn)
 
     if os.path.exists(args.search_db):
         neither = False
-        search_db(args)
+        search_db(args, gaps_conn)
+
+    gaps_conn.close()
 
     if neither:
         print("Must pass --logs-directory or --search-db 'gaps.db'")